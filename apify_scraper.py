@@ -5,20 +5,58 @@ Calls Apify API to scrape TikTok, extracts restaurants, uploads to Supabase
 """
 
 import requests
-import json
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import orjson
 import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import List, Dict
-from collections import Counter
 
-# NLP and text processing
-import spacy
-from rapidfuzz import fuzz
+# Text processing
+import ahocorasick
 import re
 
 # Data processing
 import pandas as pd
 
+# Caption cleanup patterns, compiled once
+_URL_RE = re.compile(r'http\S+|www\S+')
+_WS_RE = re.compile(r'\s+')
+
+# Shared Apify session: keep-alive across the run/poll/dataset calls,
+# and retry idempotent requests on transient failures. main() uses it from one
+# thread per hashtag; that relies on urllib3's connection pool being thread-safe,
+# and nothing here mutates session state (headers, cookies) after setup.
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=20,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 502, 503, 504])
+))
+
+# Supabase uploads: rows per upsert request, concurrent requests
+SUPABASE_BATCH_SIZE = 500
+UPLOAD_WORKERS = 16
+
+# tiktok_posts columns and the default for posts missing them (None -> null)
+POST_COLUMNS = {
+    'id': None,
+    'url': None,
+    'caption': '',
+    'likes': 0,
+    'comments': 0,
+    'shares': 0,
+    'views': 0,
+    'creator': '',
+    'create_time': None,
+    'hashtag': None,
+    'restaurants': None,
+    'has_restaurant_mention': False,
+    'scraped_at': None
+}
+
 
 class RestaurantExtractor:
     """Extract restaurant names from TikTok captions"""
@@ -45,40 +83,67 @@ class RestaurantExtractor:
         'bbq': 'BBQ Restaurant'
     }
 
+    # Packed (keyword, name) pairs for building the matcher
+    KEYWORD_PAIRS = tuple((sys.intern(k), sys.intern(v)) for k, v in KNOWN_RESTAURANTS.items())
+
     def __init__(self):
-        print("🧠 Loading spaCy NLP model...")
-        self.nlp = spacy.load('en_core_web_sm')
+        # Exact keyword matcher: one linear pass per caption
+        self.ac = ahocorasick.Automaton()
+        for order, (keyword, restaurant_name) in enumerate(self.KEYWORD_PAIRS):
+            self.ac.add_word(keyword, (order, keyword, restaurant_name))
+        self.ac.make_automaton()
 
     def clean_text(self, text: str) -> str:
         """Clean social media text"""
         if not text:
             return ""
-        text = re.sub(r'http\S+|www\S+', '', text)
-        text = re.sub(r'\s+', ' ', text).strip()
-        return text.lower()
+        return _WS_RE.sub(' ', _URL_RE.sub('', text)).strip().lower()
 
     def extract_restaurants(self, caption: str) -> List[Dict]:
         """Extract restaurant mentions from caption"""
-        restaurants = []
         if not caption:
-            return restaurants
-
-        cleaned = self.clean_text(caption)
-        seen = set()
-
-        for keyword, restaurant_name in self.KNOWN_RESTAURANTS.items():
-            if keyword in cleaned:
-                score = fuzz.partial_ratio(cleaned, keyword) / 100
-
-                if score >= 0.60 and restaurant_name not in seen:
+            return []
+        return self.match_cleaned([self.clean_text(caption)])[0]
+
+    def extract_restaurants_batch(self, captions: pd.Series) -> List[List[Dict]]:
+        """Extract restaurant mentions for a whole column of captions"""
+        cleaned = (
+            captions.fillna('')
+            .str.replace(_URL_RE, '', regex=True)
+            .str.replace(_WS_RE, ' ', regex=True)
+            .str.strip()
+            .str.lower()
+        )
+
+        # Reposts share captions: match each distinct caption once
+        unique = cleaned.unique().tolist()
+        matches = dict(zip(unique, self.match_cleaned(unique)))
+        return [matches[text] for text in cleaned]
+
+    def match_cleaned(self, cleaned: List[str]) -> List[List[Dict]]:
+        """Match cleaned captions against the known keywords (exact substring hits)"""
+        results = []
+
+        for text in cleaned:
+            restaurants = []
+            results.append(restaurants)
+
+            # Nothing to match once URLs are gone (empty, emoji-only, punctuation)
+            if not text or not any(c.isalpha() for c in text):
+                continue
+
+            # Report hits in KNOWN_RESTAURANTS order, not caption order
+            seen = set()
+            for _, keyword, restaurant_name in sorted({hit for _, hit in self.ac.iter(text)}):
+                if restaurant_name not in seen:
                     restaurants.append({
                         'name': restaurant_name,
                         'mentioned_as': keyword,
-                        'confidence': round(score, 2)
+                        'confidence': 1.0
                     })
                     seen.add(restaurant_name)
 
-        return restaurants
+        return results
 
 
 def scrape_tiktok_with_apify(hashtag: str, max_posts: int = 50) -> List[Dict]:
@@ -94,8 +159,9 @@ def scrape_tiktok_with_apify(hashtag: str, max_posts: int = 50) -> List[Dict]:
     # Correct actor ID with tilde
     actor_id = "apidojo~tiktok-scraper"
     
-    # Use the async run endpoint (not sync)
-    run_url = f"https://api.apify.com/v2/acts/{actor_id}/runs?token={APIFY_TOKEN}"
+    # Use the async run endpoint (not sync); waitForFinish lets short runs finish
+    # within the start request so they need no status polls at all
+    run_url = f"https://api.apify.com/v2/acts/{actor_id}/runs?token={APIFY_TOKEN}&waitForFinish=60"
 
     # Input that matches what worked on web interface
     input_data = {
@@ -111,55 +177,60 @@ def scrape_tiktok_with_apify(hashtag: str, max_posts: int = 50) -> List[Dict]:
     headers = {"Content-Type": "application/json"}
 
     try:
-        print(f"  ⏳ Starting Apify run...")
-        response = requests.post(run_url, json=input_data, headers=headers, timeout=60)
+        print(f"  ⏳ #{hashtag}: Starting Apify run...")
+        response = SESSION.post(run_url, data=orjson.dumps(input_data), headers=headers, timeout=90)
         response.raise_for_status()
 
-        run_data = response.json()['data']
+        run_data = orjson.loads(response.content)['data']
         run_id = run_data['id']
         dataset_id = run_data['defaultDatasetId']
 
-        print(f"  🔄 Run ID: {run_id}")
-        print(f"  ⏳ Waiting for completion (may take 2-5 minutes)...")
+        print(f"  🔄 #{hashtag}: Run ID: {run_id}")
 
         # Poll for completion
         import time
         max_wait = 600
         start_time = time.time()
 
-        while time.time() - start_time < max_wait:
-            status_url = f"https://api.apify.com/v2/actor-runs/{run_id}?token={APIFY_TOKEN}"
-            status_response = requests.get(status_url, timeout=30)
-            status_response.raise_for_status()
+        finished = ['SUCCEEDED', 'FAILED', 'ABORTED', 'TIMED-OUT']
+        run_status = run_data['status']
 
-            run_status = status_response.json()['data']['status']
+        if run_status not in finished:
+            print(f"  ⏳ #{hashtag}: Waiting for completion (may take 2-5 minutes)...")
 
-            if run_status == 'SUCCEEDED':
-                print(f"  ✅ Run succeeded!")
-                break
-            elif run_status in ['FAILED', 'ABORTED', 'TIMED-OUT']:
-                print(f"  ❌ Run {run_status}")
+        while run_status not in finished:
+            if time.time() - start_time >= max_wait:
+                print(f"  ⏱️  #{hashtag}: Run timed out")
                 return []
-            else:
-                print(f"     Status: {run_status}...")
-                time.sleep(10)
-        else:
-            print(f"  ⏱️  Run timed out")
+
+            print(f"     #{hashtag}: Status: {run_status}...")
+
+            # waitForFinish blocks server-side for up to 60s and returns as soon as the run ends
+            status_url = f"https://api.apify.com/v2/actor-runs/{run_id}?token={APIFY_TOKEN}&waitForFinish=60"
+            status_response = SESSION.get(status_url, timeout=90)
+            status_response.raise_for_status()
+
+            run_status = orjson.loads(status_response.content)['data']['status']
+
+        if run_status != 'SUCCEEDED':
+            print(f"  ❌ #{hashtag}: Run {run_status}")
             return []
+        print(f"  ✅ #{hashtag}: Run succeeded!")
 
         # Get results from dataset
-        print(f"  📥 Fetching results from dataset...")
-        dataset_url = f"https://api.apify.com/v2/datasets/{dataset_id}/items?token={APIFY_TOKEN}"
-        dataset_response = requests.get(dataset_url, timeout=30)
+        print(f"  📥 #{hashtag}: Fetching results from dataset...")
+        # JSONL + streaming: parse one item at a time instead of the whole array
+        dataset_url = f"https://api.apify.com/v2/datasets/{dataset_id}/items?token={APIFY_TOKEN}&format=jsonl"
+        dataset_response = SESSION.get(dataset_url, timeout=30, stream=True)
         dataset_response.raise_for_status()
 
-        videos = dataset_response.json()
-        
-        print(f"  ✅ Got {len(videos)} videos from Apify")
-
         # Transform to our format
         posts = []
-        for video in videos:
+        now_iso = datetime.now().isoformat()
+        for line in dataset_response.iter_lines():
+            if not line:
+                continue
+            video = orjson.loads(line)
             post = {
                 'id': str(video.get('id', '')),
                 'url': video.get('videoUrl', video.get('url', '')),
@@ -169,32 +240,68 @@ def scrape_tiktok_with_apify(hashtag: str, max_posts: int = 50) -> List[Dict]:
                 'shares': video.get('shareCount', video.get('shares', 0)),
                 'views': video.get('playCount', video.get('views', 0)),
                 'creator': video.get('authorId', video.get('channel', {}).get('uniqueId', '')),
-                'create_time': datetime.now().isoformat(),
+                'create_time': now_iso,
                 'hashtag': hashtag,
-                'scraped_at': datetime.now().isoformat(),
+                'scraped_at': now_iso,
                 'source': 'apify'
             }
             posts.append(post)
 
-        print(f"  ✅ Processed {len(posts)} videos")
+        print(f"  ✅ #{hashtag}: Got {len(posts)} videos from Apify")
         return posts
 
     except requests.exceptions.HTTPError as e:
-        print(f"  ❌ HTTP Error: {e}")
+        print(f"  ❌ #{hashtag}: HTTP Error: {e}")
         try:
-            error_detail = e.response.json()
-            print(f"  📋 Apify error: {json.dumps(error_detail, indent=2)}")
+            error_detail = orjson.loads(e.response.content)
+            print(f"  📋 #{hashtag}: Apify error: {orjson.dumps(error_detail, option=orjson.OPT_INDENT_2).decode()}")
         except:
-            print(f"  📋 Response text: {e.response.text[:300]}")
+            print(f"  📋 #{hashtag}: Response text: {e.response.text[:300]}")
         return []
     except Exception as e:
-        print(f"  ❌ Error: {str(e)}")
+        print(f"  ❌ #{hashtag}: Error: {str(e)}")
         import traceback
         traceback.print_exc()
         return []
 
 
 
+def posts_to_rows(posts: List[Dict]) -> List[Dict]:
+    """Shape scraped posts into tiktok_posts rows"""
+    df = pd.DataFrame(posts).reindex(columns=list(POST_COLUMNS))
+    df = df.fillna({col: val for col, val in POST_COLUMNS.items() if val is not None})
+
+    # Non-numeric counts (e.g. '1.2K', 'N/A') become 0 rather than failing the whole upload
+    for col in ['likes', 'comments', 'shares', 'views']:
+        df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype(int)
+    df['has_restaurant_mention'] = df['has_restaurant_mention'].astype(bool)
+    df['restaurants'] = df['restaurants'].map(
+        lambda r: orjson.dumps(r if isinstance(r, list) else []).decode()  # JSON array
+    )
+
+    # Remaining gaps go to Supabase as null
+    df = df.astype(object).where(df.notna(), None)
+    return df.to_dict(orient='records')
+
+
+def upsert_batch(supabase, batch: List[Dict]) -> int:
+    """Upsert a batch of rows, retrying row by row if the batch fails"""
+    try:
+        supabase.table('tiktok_posts').upsert(batch).execute()
+        return len(batch)
+    except Exception as e:
+        print(f"   ⚠️  Batch of {len(batch)} failed, retrying per row: {str(e)[:60]}")
+
+    uploaded = 0
+    for row in batch:
+        try:
+            supabase.table('tiktok_posts').upsert(row).execute()
+            uploaded += 1
+        except Exception as e:
+            print(f"   ❌ Error uploading {row.get('id')}: {str(e)[:60]}")
+    return uploaded
+
+
 def upload_to_supabase(posts: List[Dict]) -> bool:
     """Upload posts to Supabase"""
 
@@ -210,36 +317,21 @@ def upload_to_supabase(posts: List[Dict]) -> bool:
     print(f"\n📤 Uploading {len(posts)} posts to Supabase...")
     supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
 
-    uploaded = 0
-    errors = 0
-
-    for post in posts:
-        try:
-            row = {
-                'id': post.get('id'),
-                'url': post.get('url'),
-                'caption': post.get('caption', ''),
-                'likes': post.get('likes', 0),
-                'comments': post.get('comments', 0),
-                'shares': post.get('shares', 0),
-                'views': post.get('views', 0),
-                'creator': post.get('creator', ''),
-                'create_time': post.get('create_time'),
-                'hashtag': post.get('hashtag'),
-                'restaurants': json.dumps(post.get('restaurants', [])),
-                'has_restaurant_mention': post.get('has_restaurant_mention', False),
-                'scraped_at': post.get('scraped_at')
-            }
+    rows = posts_to_rows(posts)
 
-            supabase.table('tiktok_posts').upsert(row).execute()
-            uploaded += 1
+    # A batch can't upsert the same id twice; keep the last copy like sequential upserts did
+    rows = list({row['id']: row for row in rows}.values())
 
-            if uploaded % 10 == 0:
-                print(f"   ✓ Uploaded {uploaded} posts...")
+    uploaded = 0
+    errors = 0
 
-        except Exception as e:
-            print(f"   ❌ Error uploading {post.get('id')}: {str(e)[:60]}")
-            errors += 1
+    # Batches hold disjoint ids, so they can go out over parallel connections
+    batches = [rows[i:i + SUPABASE_BATCH_SIZE] for i in range(0, len(rows), SUPABASE_BATCH_SIZE)]
+    with ThreadPoolExecutor(max_workers=min(UPLOAD_WORKERS, len(batches))) as pool:
+        for batch, ok in zip(batches, pool.map(lambda b: upsert_batch(supabase, b), batches)):
+            uploaded += ok
+            errors += len(batch) - ok
+            print(f"   ✓ Uploaded {uploaded} posts...")
 
     print(f"   ✅ Uploaded: {uploaded} posts")
     if errors > 0:
@@ -266,10 +358,15 @@ def main():
     print(f"\n📊 Scraping {len(hashtags)} hashtags with Apify...")
     all_posts = []
 
-    for hashtag in hashtags:
-        print(f"\n🎯 Hashtag: #{hashtag}")
-        posts = scrape_tiktok_with_apify(hashtag, max_posts_per_hashtag)
-        all_posts.extend(posts)
+    # Each run spends minutes waiting on Apify, so start them all at once
+    print(f"\n🎯 Hashtags: {', '.join('#' + h for h in hashtags)}")
+    with ThreadPoolExecutor(max_workers=len(hashtags)) as pool:
+        results = pool.map(
+            lambda h: scrape_tiktok_with_apify(h, max_posts_per_hashtag),
+            hashtags
+        )
+        for posts in results:
+            all_posts.extend(posts)
 
     print(f"\n{'='*60}")
     print(f"✅ Total scraped: {len(all_posts)} posts")
@@ -280,18 +377,14 @@ def main():
 
     # Extract restaurants
     print(f"\n🔄 Processing posts and extracting restaurants...")
-    processed_posts = []
-
-    for post in all_posts:
-        caption = post.get('caption', '')
-        restaurants = extractor.extract_restaurants(caption)
-
-        processed_post = {
-            **post,
-            'restaurants': restaurants,
-            'has_restaurant_mention': len(restaurants) > 0
-        }
-        processed_posts.append(processed_post)
+    df = pd.DataFrame(all_posts)
+    restaurants = extractor.extract_restaurants_batch(df['caption'])
+    processed_posts = [
+        {**post, 'restaurants': rests, 'has_restaurant_mention': len(rests) > 0}
+        for post, rests in zip(all_posts, restaurants)
+    ]
+    df['restaurants'] = pd.Series(restaurants, index=df.index, dtype=object)
+    df['has_restaurant_mention'] = [post['has_restaurant_mention'] for post in processed_posts]
 
     # Analysis
     print(f"\n{'='*60}")
@@ -299,8 +392,6 @@ def main():
     print(f"{'='*60}")
 
     if len(processed_posts) > 0:
-        df = pd.DataFrame(processed_posts)
-
         print(f"\n📌 Posts Collected:")
         print(f"   Total: {len(df)}")
         posts_with_rests = df['has_restaurant_mention'].sum()
@@ -314,15 +405,29 @@ def main():
         print(f"   Avg views: {df['views'].mean():.0f}")
         print(f"   Total engagement: {(df['likes'] + df['comments'] + df['shares']).sum():.0f}")
 
-        # Top restaurants
-        restaurant_mentions = Counter()
-        for post in processed_posts:
-            for rest in post['restaurants']:
-                restaurant_mentions[rest['name']] += 1
+        # Top restaurants: one row per (post, restaurant) mention
+        mentions = (
+            df[['likes', 'comments', 'shares', 'restaurants']]
+            .explode('restaurants')
+            .dropna(subset=['restaurants'])
+            .rename_axis('post')
+            .reset_index()
+        )
+        mentions['name'] = mentions['restaurants'].str['name']
+        mentions['engagement'] = mentions['likes'] + mentions['comments'] + mentions['shares']
+        restaurant_stats = (
+            mentions.groupby('name', sort=False)
+            .agg(
+                mentions=('name', 'size'),
+                posts=('post', 'nunique'),
+                total_engagement=('engagement', 'sum')
+            )
+            .sort_values('mentions', ascending=False, kind='stable')
+        )
 
         print(f"\n🏪 Top Restaurants Mentioned:")
-        if restaurant_mentions:
-            for rest, count in restaurant_mentions.most_common(10):
+        if len(restaurant_stats) > 0:
+            for rest, count in restaurant_stats['mentions'].head(10).items():
                 print(f"   • {rest}: {count} mentions")
         else:
             print("   ℹ️ No restaurants found in captions")
@@ -332,8 +437,8 @@ def main():
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
 
         json_file = f'posts_raw_{timestamp}.json'
-        with open(json_file, 'w') as f:
-            json.dump(processed_posts, f, indent=2)
+        with open(json_file, 'wb') as f:
+            f.write(orjson.dumps(processed_posts, option=orjson.OPT_INDENT_2))
         print(f"   ✅ Saved: {json_file}")
 
         # Upload to Supabase
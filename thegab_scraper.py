@@ -5,14 +5,13 @@ Scrapes real TikTok data and extracts restaurant mentions
 """
 
 import asyncio
-import json
+import sys
+import orjson
 from datetime import datetime
 from typing import List, Dict
-from collections import Counter
 
-# NLP and text processing
-import spacy
-from rapidfuzz import fuzz
+# Text processing
+import ahocorasick
 import re
 
 # TikTok scraping
@@ -26,6 +25,10 @@ except ImportError:
 # Data processing
 import pandas as pd
 
+# Caption cleanup patterns, compiled once
+_URL_RE = re.compile(r'http\S+|www\S+')
+_WS_RE = re.compile(r'\s+')
+
 
 class RestaurantExtractor:
     """Extract restaurant names from TikTok captions"""
@@ -52,40 +55,67 @@ class RestaurantExtractor:
         'bbq': 'BBQ Restaurant'
     }
 
+    # Packed (keyword, name) pairs for building the matcher
+    KEYWORD_PAIRS = tuple((sys.intern(k), sys.intern(v)) for k, v in KNOWN_RESTAURANTS.items())
+
     def __init__(self):
-        print("🧠 Loading spaCy NLP model...")
-        self.nlp = spacy.load('en_core_web_sm')
+        # Exact keyword matcher: one linear pass per caption
+        self.ac = ahocorasick.Automaton()
+        for order, (keyword, restaurant_name) in enumerate(self.KEYWORD_PAIRS):
+            self.ac.add_word(keyword, (order, keyword, restaurant_name))
+        self.ac.make_automaton()
 
     def clean_text(self, text: str) -> str:
         """Clean social media text"""
         if not text:
             return ""
-        text = re.sub(r'http\S+|www\S+', '', text)
-        text = re.sub(r'\s+', ' ', text).strip()
-        return text.lower()
+        return _WS_RE.sub(' ', _URL_RE.sub('', text)).strip().lower()
 
     def extract_restaurants(self, caption: str) -> List[Dict]:
         """Extract restaurant mentions from caption"""
-        restaurants = []
         if not caption:
-            return restaurants
-
-        cleaned = self.clean_text(caption)
-        seen = set()
-
-        for keyword, restaurant_name in self.KNOWN_RESTAURANTS.items():
-            if keyword in cleaned:
-                score = fuzz.partial_ratio(cleaned, keyword) / 100
-
-                if score >= 0.60 and restaurant_name not in seen:
+            return []
+        return self.match_cleaned([self.clean_text(caption)])[0]
+
+    def extract_restaurants_batch(self, captions: pd.Series) -> List[List[Dict]]:
+        """Extract restaurant mentions for a whole column of captions"""
+        cleaned = (
+            captions.fillna('')
+            .str.replace(_URL_RE, '', regex=True)
+            .str.replace(_WS_RE, ' ', regex=True)
+            .str.strip()
+            .str.lower()
+        )
+
+        # Reposts share captions: match each distinct caption once
+        unique = cleaned.unique().tolist()
+        matches = dict(zip(unique, self.match_cleaned(unique)))
+        return [matches[text] for text in cleaned]
+
+    def match_cleaned(self, cleaned: List[str]) -> List[List[Dict]]:
+        """Match cleaned captions against the known keywords (exact substring hits)"""
+        results = []
+
+        for text in cleaned:
+            restaurants = []
+            results.append(restaurants)
+
+            # Nothing to match once URLs are gone (empty, emoji-only, punctuation)
+            if not text or not any(c.isalpha() for c in text):
+                continue
+
+            # Report hits in KNOWN_RESTAURANTS order, not caption order
+            seen = set()
+            for _, keyword, restaurant_name in sorted({hit for _, hit in self.ac.iter(text)}):
+                if restaurant_name not in seen:
                     restaurants.append({
                         'name': restaurant_name,
                         'mentioned_as': keyword,
-                        'confidence': round(score, 2)
+                        'confidence': 1.0
                     })
                     seen.add(restaurant_name)
 
-        return restaurants
+        return results
 
 
 async def scrape_tiktok_hashtag(hashtag: str, max_posts: int = 30) -> List[Dict]:
@@ -108,6 +138,7 @@ async def scrape_tiktok_hashtag(hashtag: str, max_posts: int = 30) -> List[Dict]
 
             print(f"  ⬇️  Fetching videos...")
             count = 0
+            now_iso = datetime.now().isoformat()
 
             async for video in tag.videos(count=max_posts):
                 try:
@@ -120,9 +151,9 @@ async def scrape_tiktok_hashtag(hashtag: str, max_posts: int = 30) -> List[Dict]
                         'shares': video.stats.share_count if hasattr(video.stats, 'share_count') else 0,
                         'views': video.stats.play_count if hasattr(video.stats, 'play_count') else 0,
                         'creator': video.author.username if hasattr(video.author, 'username') else 'unknown',
-                        'create_time': datetime.fromtimestamp(video.create_time).isoformat() if hasattr(video, 'create_time') else datetime.now().isoformat(),
+                        'create_time': datetime.fromtimestamp(video.create_time).isoformat() if hasattr(video, 'create_time') else now_iso,
                         'hashtag': hashtag,
-                        'scraped_at': datetime.now().isoformat(),
+                        'scraped_at': now_iso,
                         'source': 'tiktokapi'
                     }
                     posts.append(post)
@@ -175,18 +206,14 @@ def main():
 
     # Process posts
     print(f"\n🔄 Processing posts and extracting restaurants...")
-    processed_posts = []
-
-    for post in all_posts:
-        caption = post.get('caption', '')
-        restaurants = extractor.extract_restaurants(caption)
-
-        processed_post = {
-            **post,
-            'restaurants': restaurants,
-            'has_restaurant_mention': len(restaurants) > 0
-        }
-        processed_posts.append(processed_post)
+    df = pd.DataFrame(all_posts)
+    restaurants = extractor.extract_restaurants_batch(df['caption'])
+    processed_posts = [
+        {**post, 'restaurants': rests, 'has_restaurant_mention': len(rests) > 0}
+        for post, rests in zip(all_posts, restaurants)
+    ]
+    df['restaurants'] = pd.Series(restaurants, index=df.index, dtype=object)
+    df['has_restaurant_mention'] = [post['has_restaurant_mention'] for post in processed_posts]
 
     # Analysis
     print(f"\n{'='*60}")
@@ -194,8 +221,6 @@ def main():
     print(f"{'='*60}")
 
     if len(processed_posts) > 0:
-        df = pd.DataFrame(processed_posts)
-
         print(f"\n📌 Posts Collected:")
         print(f"   Total: {len(df)}")
         posts_with_rests = df['has_restaurant_mention'].sum()
@@ -209,15 +234,29 @@ def main():
         print(f"   Avg views: {df['views'].mean():.0f}")
         print(f"   Total engagement: {(df['likes'] + df['comments'] + df['shares']).sum():.0f}")
 
-        # Top restaurants
-        restaurant_mentions = Counter()
-        for post in processed_posts:
-            for rest in post['restaurants']:
-                restaurant_mentions[rest['name']] += 1
+        # Top restaurants: one row per (post, restaurant) mention
+        mentions = (
+            df[['likes', 'comments', 'shares', 'restaurants']]
+            .explode('restaurants')
+            .dropna(subset=['restaurants'])
+            .rename_axis('post')
+            .reset_index()
+        )
+        mentions['name'] = mentions['restaurants'].str['name']
+        mentions['engagement'] = mentions['likes'] + mentions['comments'] + mentions['shares']
+        restaurant_stats = (
+            mentions.groupby('name', sort=False)
+            .agg(
+                mentions=('name', 'size'),
+                posts=('post', 'nunique'),
+                total_engagement=('engagement', 'sum')
+            )
+            .sort_values('mentions', ascending=False, kind='stable')
+        )
 
         print(f"\n🏪 Top Restaurants Mentioned:")
-        if restaurant_mentions:
-            for rest, count in restaurant_mentions.most_common(10):
+        if len(restaurant_stats) > 0:
+            for rest, count in restaurant_stats['mentions'].head(10).items():
                 print(f"   • {rest}: {count} mentions")
         else:
             print("   ℹ️ No restaurants found in captions")
@@ -239,27 +278,16 @@ def main():
 
         # Save JSON
         json_file = f'posts_raw_{timestamp}.json'
-        with open(json_file, 'w') as f:
-            json.dump(processed_posts, f, indent=2)
+        with open(json_file, 'wb') as f:
+            f.write(orjson.dumps(processed_posts, option=orjson.OPT_INDENT_2))
         print(f"   ✅ Saved: {json_file}")
 
         # Save CSV
         csv_file = f'restaurant_metrics_{timestamp}.csv'
-        restaurant_stats = []
-        for rest_name, count in restaurant_mentions.most_common():
-            rest_posts = [p for p in processed_posts if any(r['name'] == rest_name for r in p['restaurants'])]
-            total_eng = sum(p.get('likes', 0) + p.get('comments', 0) + p.get('shares', 0) for p in rest_posts)
-            avg_eng = total_eng / len(rest_posts) if rest_posts else 0
-
-            restaurant_stats.append({
-                'restaurant': rest_name,
-                'mentions': count,
-                'posts': len(rest_posts),
-                'total_engagement': int(total_eng),
-                'avg_engagement': int(avg_eng)
-            })
-
-        pd.DataFrame(restaurant_stats).to_csv(csv_file, index=False)
+        metrics = restaurant_stats.rename_axis('restaurant').reset_index()
+        metrics['total_engagement'] = metrics['total_engagement'].astype(int)
+        metrics['avg_engagement'] = (metrics['total_engagement'] / metrics['posts']).astype(int)
+        metrics.to_csv(csv_file, index=False)
         print(f"   ✅ Saved: {csv_file}")
 
         # Save summary
@@ -269,11 +297,11 @@ def main():
             'total_posts': len(processed_posts),
             'posts_with_restaurants': int(posts_with_rests),
             'extraction_rate': f'{extraction_rate:.1f}%',
-            'unique_restaurants': len(restaurant_mentions),
-            'top_restaurant': restaurant_mentions.most_common(1)[0][0] if restaurant_mentions else None
+            'unique_restaurants': len(restaurant_stats),
+            'top_restaurant': restaurant_stats.index[0] if len(restaurant_stats) > 0 else None
         }
-        with open(summary_file, 'w') as f:
-            json.dump(summary, f, indent=2)
+        with open(summary_file, 'wb') as f:
+            f.write(orjson.dumps(summary, option=orjson.OPT_INDENT_2))
         print(f"   ✅ Saved: {summary_file}")
 
         print(f"\n{'='*60}")
@@ -3,10 +3,12 @@
 Upload scraped TikTok data to Supabase
 """
 
-import json
+import orjson
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from glob import glob
+import pandas as pd
 from supabase import create_client, Client
 
 # Environment variables
@@ -18,6 +20,27 @@ if not SUPABASE_URL or not SUPABASE_KEY:
     print("   Set them in GitHub Secrets")
     exit(1)
 
+# Rows per upsert request, concurrent upsert requests
+BATCH_SIZE = 500
+UPLOAD_WORKERS = 16
+
+# tiktok_posts columns and the default for posts missing them (None -> null)
+POST_COLUMNS = {
+    'id': None,
+    'url': None,
+    'caption': '',
+    'likes': 0,
+    'comments': 0,
+    'shares': 0,
+    'views': 0,
+    'creator': '',
+    'create_time': None,
+    'hashtag': None,
+    'restaurants': None,
+    'has_restaurant_mention': False,
+    'scraped_at': None
+}
+
 # Initialize Supabase
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
@@ -26,13 +49,49 @@ print("📤 UPLOADING TO SUPABASE")
 print("="*60)
 
 
+def posts_to_rows(posts):
+    """Shape scraped posts into tiktok_posts rows"""
+    df = pd.DataFrame(posts).reindex(columns=list(POST_COLUMNS))
+    df = df.fillna({col: val for col, val in POST_COLUMNS.items() if val is not None})
+
+    # Non-numeric counts (e.g. '1.2K', 'N/A') become 0 rather than failing the whole upload
+    for col in ['likes', 'comments', 'shares', 'views']:
+        df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype(int)
+    df['has_restaurant_mention'] = df['has_restaurant_mention'].astype(bool)
+    df['restaurants'] = df['restaurants'].map(
+        lambda r: orjson.dumps(r if isinstance(r, list) else []).decode()  # JSON array
+    )
+
+    # Remaining gaps go to Supabase as null
+    df = df.astype(object).where(df.notna(), None)
+    return df.to_dict(orient='records')
+
+
+def upsert_post_batch(batch):
+    """Upsert a batch of post rows, retrying row by row if the batch fails"""
+    try:
+        supabase.table('tiktok_posts').upsert(batch).execute()
+        return len(batch)
+    except Exception as e:
+        print(f"   ⚠️  Batch of {len(batch)} failed, retrying per row: {str(e)[:80]}")
+
+    uploaded = 0
+    for row in batch:
+        try:
+            supabase.table('tiktok_posts').upsert(row).execute()
+            uploaded += 1
+        except Exception as e:
+            print(f"   ❌ Error uploading post {row.get('id')}: {str(e)[:80]}")
+    return uploaded
+
+
 def upload_posts_to_supabase(json_file):
     """Upload raw posts to Supabase"""
 
     print(f"\n📁 Reading: {json_file}")
 
-    with open(json_file, 'r') as f:
-        posts = json.load(f)
+    with open(json_file, 'rb') as f:
+        posts = orjson.loads(f.read())
 
     print(f"   Posts to upload: {len(posts)}")
 
@@ -40,39 +99,23 @@ def upload_posts_to_supabase(json_file):
         print("   ⚠️  No posts to upload")
         return
 
-    # Upload each post
-    uploaded = 0
-    errors = 0
+    # Transform post data for Supabase
+    rows = posts_to_rows(posts)
 
-    for post in posts:
-        try:
-            # Transform post data for Supabase
-            row = {
-                'id': post.get('id'),
-                'url': post.get('url'),
-                'caption': post.get('caption', ''),
-                'likes': post.get('likes', 0),
-                'comments': post.get('comments', 0),
-                'shares': post.get('shares', 0),
-                'views': post.get('views', 0),
-                'creator': post.get('creator', ''),
-                'create_time': post.get('create_time'),
-                'hashtag': post.get('hashtag'),
-                'restaurants': json.dumps(post.get('restaurants', [])),  # JSON array
-                'has_restaurant_mention': post.get('has_restaurant_mention', False),
-                'scraped_at': post.get('scraped_at')
-            }
+    # A batch can't upsert the same id twice; keep the last copy like sequential upserts did
+    rows = list({row['id']: row for row in rows}.values())
 
-            # Insert into Supabase (use upsert to handle duplicates)
-            response = supabase.table('tiktok_posts').upsert(row).execute()
-            uploaded += 1
-
-            if uploaded % 10 == 0:
-                print(f"   ✓ Uploaded {uploaded} posts...")
+    # Upload in batches (use upsert to handle duplicates)
+    uploaded = 0
+    errors = 0
 
-        except Exception as e:
-            print(f"   ❌ Error uploading post {post.get('id')}: {str(e)[:80]}")
-            errors += 1
+    # Batches hold disjoint ids, so they can go out over parallel connections
+    batches = [rows[i:i + BATCH_SIZE] for i in range(0, len(rows), BATCH_SIZE)]
+    with ThreadPoolExecutor(max_workers=min(UPLOAD_WORKERS, len(batches))) as pool:
+        for batch, ok in zip(batches, pool.map(upsert_post_batch, batches)):
+            uploaded += ok
+            errors += len(batch) - ok
+            print(f"   ✓ Uploaded {uploaded} posts...")
 
     print(f"   ✅ Uploaded: {uploaded} posts")
     if errors > 0:
@@ -84,13 +127,13 @@ def upload_restaurants_to_supabase(csv_file):
 
     print(f"\n📊 Reading: {csv_file}")
 
-    import pandas as pd
     df = pd.read_csv(csv_file)
 
     print(f"   Restaurants to upload: {len(df)}")
 
     uploaded = 0
     errors = 0
+    now_iso = datetime.now().isoformat()
 
     for _, row in df.iterrows():
         try:
@@ -100,7 +143,7 @@ def upload_restaurants_to_supabase(csv_file):
                 'posts': int(row['posts']),
                 'total_engagement': int(row['total_engagement']),
                 'avg_engagement': int(row['avg_engagement']),
-                'last_updated': datetime.now().isoformat()
+                'last_updated': now_iso
             }
 
             # Upsert by restaurant name